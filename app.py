@@ -1,15 +1,27 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, render_template, request, session, send_from_directory, Response, stream_with_context
+from flask_caching import Cache
+from jinja2 import FileSystemBytecodeCache
 import secrets
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from groq import Groq
 from openai import OpenAI
 import json
+import orjson
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import wraps, lru_cache
 import time
 import os
 from dotenv import load_dotenv
-from collections import defaultdict
+from collections import deque
+from itertools import islice
+from threading import Lock, RLock
+from cachetools import TLRUCache, TTLCache
+import hashlib
+import math
+import re
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,15 +33,58 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', secrets.token_hex(16))
 # Configuration
 CACHE_DURATION = int(os.getenv('CACHE_DURATION', 3600))  # 1 hour default
 MAX_HISTORY = int(os.getenv('MAX_HISTORY', 10))  # Maximum number of searches
+CACHE_MAX = int(os.getenv('CACHE_MAX', 1024))  # Maximum number of cached results
+NEGATIVE_CACHE_DURATION = int(os.getenv('NEGATIVE_CACHE_DURATION', 60))  # errors/empty results, doubled per repeat failure
 
 # Rate limiting configuration
 RATE_LIMIT_SEARCHES = 50  # searches per hour
 RATE_LIMIT_WINDOW = 3600  # 1 hour in seconds
+RATE_LIMIT_CLEANUP_INTERVAL = 100  # sweep idle users every N checks
+MAX_CONCURRENT_ANSWERS = 3  # in-flight AI answers per user
+INFLIGHT_TIMEOUT = 300  # seconds before a stuck in-flight answer stops counting (Redis only)
+PENDING_ANSWER_TTL = 300  # seconds a search waits for its answer stream to be opened
+
+# Redis configuration - when set, cache, rate limits, history and pending answers are shared by all workers
+REDIS_URL = os.getenv('REDIS_URL')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 32))
+REDIS_CACHE_PREFIX = b'hybridsearch:cache:'
+REDIS_FAILURES_PREFIX = b'hybridsearch:failures:'
+REDIS_RATE_LIMIT_PREFIX = 'hybridsearch:ratelimit:'
+REDIS_INFLIGHT_PREFIX = 'hybridsearch:inflight:'
+REDIS_ANSWER_PREFIX = 'hybridsearch:answer:'
+REDIS_HISTORY_KEY = 'hybridsearch:history'
 
 # In-memory cache, history, and rate limiting
-search_cache = {}
-search_history = []
-rate_limit_tracker = defaultdict(list)  # {user_id: [timestamp1, timestamp2, ...]}
+search_cache = TLRUCache(maxsize=CACHE_MAX, ttu=lambda key, value, now: now + get_cache_ttl(key, value))
+failure_streaks = TTLCache(maxsize=CACHE_MAX, ttl=CACHE_DURATION)  # {cache_key: consecutive negative results}
+cache_lock = RLock()
+pending_answers = TTLCache(maxsize=1024, ttl=PENDING_ANSWER_TTL)  # {token: (query, context, mode)} awaiting their answer stream
+pending_answers_lock = Lock()
+search_history = deque(maxlen=MAX_HISTORY)  # newest first
+rate_limit_tracker = {}  # {user_id: (prev_window_count, curr_window_count, window_index)}
+rate_limit_checks = 0
+rate_limit_locks = [Lock() for _ in range(64)]  # sharded by user_id
+inflight_answers = {}  # {user_id: number of answers currently streaming}
+inflight_lock = Lock()
+
+# Shared Redis client (optional)
+redis_client = None
+if REDIS_URL:
+    import redis
+    redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+        REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS
+    ))
+
+# Compiled template bytecode survives restarts, and rendered fragments are cached
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+if REDIS_URL:
+    fragment_cache = Cache(app, config={
+        'CACHE_TYPE': 'RedisCache',
+        'CACHE_REDIS_HOST': redis_client,  # share the bounded connection pool
+        'CACHE_KEY_PREFIX': 'hybridsearch:fragments:'
+    })
+else:
+    fragment_cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_THRESHOLD': CACHE_MAX})
 
 # API Configuration - Load from environment variables
 API_KEYS = {
@@ -38,14 +93,38 @@ API_KEYS = {
     'openai': os.getenv('OPENAI_API_KEY')  # Optional
 }
 
+# Keys don't change at runtime, so check for them once
+HAS_SERPER = bool(API_KEYS['serper'])
+HAS_GROQ = bool(API_KEYS['groq'])
+HAS_OPENAI = bool(API_KEYS['openai'])
+
+SERPER_HEADERS = {
+    'X-API-KEY': API_KEYS['serper'] or '',
+    'Content-Type': 'application/json'
+}
+
+# Shared HTTP session so Serper and Ollama connections are kept alive between requests
+SERPER_SESSION = requests.Session()
+SERPER_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['POST'])
+    )
+))
+
 # Validate required API keys
 def validate_api_keys():
     """Check if required API keys are configured"""
     missing_keys = []
     
-    if not API_KEYS['serper']:
+    if not HAS_SERPER:
         missing_keys.append('SERPER_API_KEY')
-    if not API_KEYS['groq']:
+    if not HAS_GROQ:
         missing_keys.append('GROQ_API_KEY')
     
     if missing_keys:
@@ -79,6 +158,14 @@ MODEL_CONFIGS = {
     }
 }
 
+# Groq model tiers - short, simple queries are routed to the faster instant model
+SPEED_TIERS = {
+    'instant': os.getenv('GROQ_INSTANT_MODEL', 'llama-3.1-8b-instant'),
+    'balanced': MODEL_CONFIGS['groq']['model']
+}
+INSTANT_TIER_MAX_WORDS = 400  # query + snippet words
+COMPLEX_QUERY_PATTERN = re.compile(r'```|\$\$|explain|compare', re.IGNORECASE)
+
 # ========== RATE LIMITING ==========
 
 def get_user_id():
@@ -87,70 +174,370 @@ def get_user_id():
         session['user_id'] = secrets.token_hex(16)
     return session['user_id']
 
-def check_rate_limit(user_id):
-    """Check if user has exceeded rate limit"""
-    now = time.time()
+# The limiter uses a rolling window approximated from two fixed windows: the
+# previous window's count is weighted by how much of it still overlaps the
+# rolling window. This assumes searches in the previous window were evenly
+# spread, so the estimate can be off by a percent or two in either direction.
+# That tolerance is accepted in exchange for O(1) memory per user.
+
+def get_rate_limit_lock(user_id):
+    """Get the lock guarding user's rate limit counters"""
+    return rate_limit_locks[hash(user_id) & 63]
+
+def get_window_counts(user_id, now):
+    """Get (prev_count, curr_count, window_index) for user, rolled forward to now"""
+    window = int(now // RATE_LIMIT_WINDOW)
+    prev_count, curr_count, stored_window = rate_limit_tracker.get(user_id, (0, 0, window))
     
-    # Clean old timestamps
-    rate_limit_tracker[user_id] = [
-        ts for ts in rate_limit_tracker[user_id]
-        if now - ts < RATE_LIMIT_WINDOW
-    ]
+    if stored_window == window - 1:
+        # Slide the last window into the previous bucket
+        prev_count, curr_count = curr_count, 0
+    elif stored_window != window:
+        # Both buckets are too old to count
+        prev_count, curr_count = 0, 0
+    
+    return prev_count, curr_count, window
+
+def estimate_searches(prev_count, curr_count, now):
+    """Estimate searches in the rolling window ending at now"""
+    overlap = (RATE_LIMIT_WINDOW - (now % RATE_LIMIT_WINDOW)) / RATE_LIMIT_WINDOW
+    return prev_count * overlap + curr_count
+
+def cleanup_rate_limits(now):
+    """Remove users with no searches left in the window"""
+    window = int(now // RATE_LIMIT_WINDOW)
+    for user_id, (_, _, stored_window) in list(rate_limit_tracker.items()):
+        if stored_window < window - 1:
+            with get_rate_limit_lock(user_id):
+                # Re-check under the lock in case the user just searched
+                if rate_limit_tracker.get(user_id, (0, 0, window))[2] < window - 1:
+                    del rate_limit_tracker[user_id]
+
+def maybe_cleanup_rate_limits(now):
+    """Periodically sweep idle users so the tracker doesn't grow forever"""
+    global rate_limit_checks
+    rate_limit_checks += 1
+    if rate_limit_checks % RATE_LIMIT_CLEANUP_INTERVAL == 0:
+        cleanup_rate_limits(now)
+
+def get_rate_limit_status(user_id, now):
+    """Get (allowed, remaining) for user without recording anything"""
+    prev_count, curr_count, _ = get_window_counts(user_id, now)
+    searches = estimate_searches(prev_count, curr_count, now)
     
     # Check limit
-    if len(rate_limit_tracker[user_id]) >= RATE_LIMIT_SEARCHES:
+    if searches >= RATE_LIMIT_SEARCHES:
         return False, 0
     
-    return True, RATE_LIMIT_SEARCHES - len(rate_limit_tracker[user_id])
+    return True, math.ceil(RATE_LIMIT_SEARCHES - searches)
+
+def check_rate_limit(user_id):
+    """Check if user has exceeded rate limit"""
+    if redis_client is not None:
+        return redis_check_rate_limit(user_id)
+    
+    now = time.time()
+    maybe_cleanup_rate_limits(now)
+    return get_rate_limit_status(user_id, now)
 
-def record_search(user_id):
-    """Record a search for rate limiting"""
-    rate_limit_tracker[user_id].append(time.time())
+def check_and_record_search(user_id):
+    """Atomically check the rate limit and record the search if allowed"""
+    if redis_client is not None:
+        return redis_check_and_record_search(user_id)
+    
+    now = time.time()
+    # Sweep before taking the user's lock; the sweep takes shard locks itself
+    maybe_cleanup_rate_limits(now)
+    
+    with get_rate_limit_lock(user_id):
+        allowed, remaining = get_rate_limit_status(user_id, now)
+        if allowed:
+            prev_count, curr_count, window = get_window_counts(user_id, now)
+            rate_limit_tracker[user_id] = (prev_count, curr_count + 1, window)
+        return allowed, remaining
 
 def rate_limit_decorator(func):
     """Decorator to enforce rate limiting"""
     @wraps(func)
     def wrapper(*args, **kwargs):
         user_id = get_user_id()
-        allowed, remaining = check_rate_limit(user_id)
+        allowed, remaining = check_and_record_search(user_id)
         
         if not allowed:
             return render_template('error.html', 
                                  error='Rate limit exceeded. Please try again in an hour.'), 429
         
-        record_search(user_id)
         return func(*args, **kwargs)
     return wrapper
 
+# ========== REDIS BACKEND ==========
+
+# Sliding window limiter: drop timestamps older than the window, then add this
+# search only if the user is still under the limit. Runs atomically in Redis.
+RATE_LIMIT_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+if count >= limit then
+    return {0, 0}
+end
+
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, window)
+return {1, limit - count}
+"""
+
+# Registered once so each call sends only the script's SHA (EVALSHA)
+rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT) if redis_client is not None else None
+
+def redis_check_rate_limit(user_id):
+    """Check if user has exceeded rate limit using Redis"""
+    key = REDIS_RATE_LIMIT_PREFIX + user_id
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', time.time() - RATE_LIMIT_WINDOW)
+        pipe.zcard(key)
+        _, count = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis rate limit error: {e}")
+        return True, RATE_LIMIT_SEARCHES
+    
+    if count >= RATE_LIMIT_SEARCHES:
+        return False, 0
+    return True, RATE_LIMIT_SEARCHES - count
+
+def redis_check_and_record_search(user_id):
+    """Atomically check the rate limit and record the search using Redis"""
+    try:
+        allowed, remaining = rate_limit_script(
+            keys=[REDIS_RATE_LIMIT_PREFIX + user_id],
+            args=[time.time(), RATE_LIMIT_WINDOW, RATE_LIMIT_SEARCHES, secrets.token_hex(8)]
+        )
+    except redis.RedisError as e:
+        # Don't block searches just because Redis is unavailable
+        print(f"Redis rate limit error: {e}")
+        return True, RATE_LIMIT_SEARCHES
+    
+    return bool(allowed), remaining
+
+def redis_acquire_answer_slot(user_id, slot_id):
+    """Reserve an in-flight answer slot in Redis, returning slot_id or None if all are taken"""
+    key = REDIS_INFLIGHT_PREFIX + user_id
+    now = time.time()
+    try:
+        pipe = redis_client.pipeline()
+        # Slots left behind by a crashed worker expire after INFLIGHT_TIMEOUT
+        pipe.zremrangebyscore(key, '-inf', now - INFLIGHT_TIMEOUT)
+        pipe.zadd(key, {slot_id: now})
+        pipe.zcard(key)
+        pipe.expire(key, INFLIGHT_TIMEOUT)
+        _, _, count, _ = pipe.execute()
+        
+        if count > MAX_CONCURRENT_ANSWERS:
+            redis_client.zrem(key, slot_id)
+            return None
+    except redis.RedisError as e:
+        print(f"Redis concurrency limit error: {e}")
+    
+    return slot_id
+
+def redis_release_answer_slot(user_id, slot_id):
+    """Release an in-flight answer slot in Redis"""
+    try:
+        redis_client.zrem(REDIS_INFLIGHT_PREFIX + user_id, slot_id)
+    except redis.RedisError as e:
+        print(f"Redis concurrency limit error: {e}")
+
+def redis_store_pending_answer(token, pending):
+    """Park a search's answer inputs in Redis so any worker can stream them"""
+    try:
+        redis_client.set(REDIS_ANSWER_PREFIX + token, orjson.dumps(pending), ex=PENDING_ANSWER_TTL)
+    except redis.RedisError as e:
+        print(f"Redis pending answer error: {e}")
+
+def redis_has_pending_answer(token):
+    """Check if a search's answer inputs are still parked in Redis"""
+    try:
+        return bool(redis_client.exists(REDIS_ANSWER_PREFIX + token))
+    except redis.RedisError as e:
+        print(f"Redis pending answer error: {e}")
+        return False
+
+def redis_pop_pending_answer(token):
+    """Atomically take a search's answer inputs from Redis"""
+    try:
+        pending = redis_client.getdel(REDIS_ANSWER_PREFIX + token)
+    except redis.RedisError as e:
+        print(f"Redis pending answer error: {e}")
+        return None
+    
+    return tuple(orjson.loads(pending)) if pending is not None else None
+
+def redis_add_to_history(history_entry):
+    """Push a search onto the shared history, keeping only MAX_HISTORY entries"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(REDIS_HISTORY_KEY, orjson.dumps(history_entry))
+        pipe.ltrim(REDIS_HISTORY_KEY, 0, MAX_HISTORY - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Redis history error: {e}")
+
+def redis_get_history(limit):
+    """Get the most recent searches from the shared history"""
+    try:
+        raw_entries = redis_client.lrange(REDIS_HISTORY_KEY, 0, limit - 1)
+    except redis.RedisError as e:
+        print(f"Redis history error: {e}")
+        return []
+    
+    entries = [orjson.loads(raw) for raw in raw_entries]
+    for entry in entries:
+        entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+    return entries
+
+def redis_clear_history():
+    """Delete the shared history"""
+    try:
+        redis_client.delete(REDIS_HISTORY_KEY)
+    except redis.RedisError as e:
+        print(f"Redis history error: {e}")
+
+def redis_cached_call(func, cache_key, args, kwargs):
+    """Call func, caching its JSON-serializable result in Redis"""
+    try:
+        cached_data = redis_client.get(REDIS_CACHE_PREFIX + cache_key)
+        if cached_data is not None:
+            print(f"Cache hit for: {func.__name__}")
+            return orjson.loads(cached_data)
+    except redis.RedisError as e:
+        print(f"Redis cache error: {e}")
+    
+    result = func(*args, **kwargs)
+    
+    try:
+        failures_key = REDIS_FAILURES_PREFIX + cache_key
+        if is_negative_result(result):
+            pipe = redis_client.pipeline()
+            pipe.incr(failures_key)
+            pipe.expire(failures_key, CACHE_DURATION)
+            streak, _ = pipe.execute()
+            ttl = get_negative_ttl(streak)
+        else:
+            redis_client.delete(failures_key)
+            ttl = CACHE_DURATION
+        redis_client.set(REDIS_CACHE_PREFIX + cache_key, orjson.dumps(result), ex=ttl)
+    except redis.RedisError as e:
+        print(f"Redis cache error: {e}")
+    
+    return result
+
+def redis_clear_cache():
+    """Delete all cached results and failure streaks from Redis"""
+    try:
+        for prefix in (REDIS_CACHE_PREFIX, REDIS_FAILURES_PREFIX):
+            keys = list(redis_client.scan_iter(match=prefix + b'*', count=1000))
+            if keys:
+                redis_client.delete(*keys)
+    except redis.RedisError as e:
+        print(f"Redis cache error: {e}")
+
+# ========== CONCURRENCY LIMITING ==========
+
+def acquire_answer_slot(user_id):
+    """Reserve one of the user's in-flight answer slots, returning a slot id or None if all are taken"""
+    slot_id = secrets.token_hex(8)
+    
+    if redis_client is not None:
+        return redis_acquire_answer_slot(user_id, slot_id)
+    
+    with inflight_lock:
+        if inflight_answers.get(user_id, 0) >= MAX_CONCURRENT_ANSWERS:
+            return None
+        inflight_answers[user_id] = inflight_answers.get(user_id, 0) + 1
+    return slot_id
+
+def release_answer_slot(user_id, slot_id):
+    """Release an in-flight answer slot"""
+    if redis_client is not None:
+        redis_release_answer_slot(user_id, slot_id)
+        return
+    
+    with inflight_lock:
+        remaining = inflight_answers.get(user_id, 0) - 1
+        if remaining > 0:
+            inflight_answers[user_id] = remaining
+        else:
+            inflight_answers.pop(user_id, None)
+
 # ========== CACHE DECORATOR ==========
-def cache_result(duration=CACHE_DURATION):
-    """Decorator to cache function results"""
+def is_negative_result(result):
+    """Check if a search result is an error or empty result"""
+    if not result:
+        return True
+    if isinstance(result, list):
+        return any(
+            isinstance(s, dict) and (s.get('source') == 'Error' or s.get('title') == 'No Results Found')
+            for s in result
+        )
+    return False
+
+def get_cache_ttl(cache_key, result):
+    """Get how long to cache a result, backing off exponentially on repeated failures"""
+    if not is_negative_result(result):
+        return CACHE_DURATION
+    
+    return get_negative_ttl(failure_streaks.get(cache_key, 1))
+
+def get_negative_ttl(streak):
+    """Get TTL for the streak-th consecutive error or empty result"""
+    return min(NEGATIVE_CACHE_DURATION * 2 ** (streak - 1), CACHE_DURATION)
+
+def cache_result():
+    """Decorator to cache function results (shorter for errors and empty results)"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Create cache key from function name and arguments
-            cache_key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
+            cache_key = hashlib.blake2b(
+                func.__name__.encode() + repr(args).encode() + repr(sorted(kwargs.items())).encode(),
+                digest_size=16
+            ).digest()
+            
+            if redis_client is not None:
+                return redis_cached_call(func, cache_key, args, kwargs)
             
-            # Check if result is in cache and not expired
-            if cache_key in search_cache:
-                cached_data, timestamp = search_cache[cache_key]
-                if time.time() - timestamp < duration:
-                    print(f"Cache hit for: {cache_key[:50]}...")
+            # Expired entries are dropped by the cache itself
+            with cache_lock:
+                try:
+                    cached_data = search_cache[cache_key]
+                    print(f"Cache hit for: {func.__name__}")
                     return cached_data
+                except KeyError:
+                    pass
             
             # Call function and cache result
             result = func(*args, **kwargs)
-            search_cache[cache_key] = (result, time.time())
+            with cache_lock:
+                if is_negative_result(result):
+                    failure_streaks[cache_key] = failure_streaks.get(cache_key, 0) + 1
+                else:
+                    failure_streaks.pop(cache_key, None)
+                search_cache[cache_key] = result
             return result
         return wrapper
     return decorator
 
 # ========== HELPER FUNCTIONS ==========
 
-@cache_result(duration=3600)
+@cache_result()
 def search_web(query):
     """Search the web using Serper API with caching"""
-    if not API_KEYS['serper']:
+    if not HAS_SERPER:
         return [{
             'title': 'API Key Not Configured',
             'snippet': 'Please add SERPER_API_KEY to your .env file. Get one at https://serper.dev',
@@ -159,14 +546,10 @@ def search_web(query):
         }]
     
     url = "https://google.serper.dev/search"
-    headers = {
-        'X-API-KEY': API_KEYS['serper'],
-        'Content-Type': 'application/json'
-    }
     payload = {'q': query, 'num': 5}
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = SERPER_SESSION.post(url, headers=SERPER_HEADERS, json=payload, timeout=10)
         response.raise_for_status()
         results = response.json()
         
@@ -205,17 +588,41 @@ def search_web(query):
             'source': 'Error'
         }]
 
-def generate_answer_groq(query, sources):
-    """Generate AI answer using Groq"""
-    if not API_KEYS['groq']:
-        return "Error: Groq API key not configured. Please add GROQ_API_KEY to your .env file."
+@lru_cache(maxsize=1)
+def get_groq_client():
+    """Get the shared Groq client, or None if no API key is configured"""
+    if not HAS_GROQ:
+        return None
+    return Groq(api_key=API_KEYS['groq'], max_retries=2, timeout=httpx.Timeout(30.0, connect=3.0))
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """Get the shared OpenAI client, or None if no API key is configured"""
+    if not HAS_OPENAI:
+        return None
+    return OpenAI(api_key=API_KEYS['openai'], max_retries=2, timeout=httpx.Timeout(30.0, connect=3.0))
+
+def build_context(sources, max_snippet_chars=300, max_title_chars=120):
+    """Join sources into prompt context, skipping errors and duplicates and trimming long text"""
+    seen_snippets = set()
+    seen_titles = set()
+    parts = []
     
-    try:
-        client = Groq(api_key=API_KEYS['groq'])
-        
-        context = "\n\n".join([f"**{s['title']}**: {s['snippet']}" for s in sources if s['source'] != 'Error'])
+    usable_sources = (s for s in sources if s['source'] != 'Error')
+    for s in usable_sources:
+        # Serper often returns the same page or boilerplate snippet more than once
+        snippet_key = s['snippet'][:64]
+        if snippet_key in seen_snippets or s['title'] in seen_titles:
+            continue
+        seen_snippets.add(snippet_key)
+        seen_titles.add(s['title'])
         
-        prompt = f"""You are a helpful AI assistant. Based on the following sources, provide a comprehensive and well-structured answer to this question: {query}
+        parts.append(f"**{s['title'][:max_title_chars]}**: {s['snippet'][:max_snippet_chars]}")
+    
+    return "\n\n".join(parts)
+
+# Answer prompts, filled in with format_prompt
+PROMPT_TEMPLATE = """You are a helpful AI assistant. Based on the following sources, provide a comprehensive and well-structured answer to this question: {query}
 
 Sources:
 {context}
@@ -228,117 +635,172 @@ Instructions:
 - Be accurate and objective
 
 Answer:"""
+
+# Shorter prompt for local models
+LOCAL_PROMPT_TEMPLATE = """Based on the following sources, answer this question: {query}
+
+Sources:
+{context}
+
+Provide a comprehensive answer:"""
+
+def format_prompt(query, context, template=PROMPT_TEMPLATE):
+    """Fill in an answer prompt template"""
+    return template.format_map({'query': query, 'context': context})
+
+def select_groq_model(query, context):
+    """Pick the Groq model tier based on prompt size and query complexity"""
+    words = len(query.split()) + len(context.split())
+    
+    if words < INSTANT_TIER_MAX_WORDS and not COMPLEX_QUERY_PATTERN.search(query):
+        return SPEED_TIERS['instant']
+    return SPEED_TIERS['balanced']
+
+# ========== STREAMING ANSWERS ==========
+
+def stream_answer_groq(query, context):
+    """Stream AI answer from Groq chunk by chunk"""
+    if not HAS_GROQ:
+        yield "Error: Groq API key not configured. Please add GROQ_API_KEY to your .env file."
+        return
+    
+    try:
+        client = get_groq_client()
+        prompt = format_prompt(query, context)
         
-        response = client.chat.completions.create(
-            model=MODEL_CONFIGS['groq']['model'],
+        stream = client.chat.completions.create(
+            model=select_groq_model(query, context),
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            service_tier='auto',
+            stream=True
         )
         
-        return response.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     
     except Exception as e:
         print(f"Groq error: {e}")
-        return f"Error generating answer with Groq: {str(e)}\n\nPlease check your API key or try a different model."
+        yield f"Error generating answer with Groq: {str(e)}\n\nPlease check your API key or try a different model."
 
-def generate_answer_openai(query, sources):
-    """Generate AI answer using OpenAI"""
-    if not API_KEYS['openai']:
-        return "Error: OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file."
+def stream_answer_openai(query, context):
+    """Stream AI answer from OpenAI chunk by chunk"""
+    if not HAS_OPENAI:
+        yield "Error: OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file."
+        return
     
     try:
-        client = OpenAI(api_key=API_KEYS['openai'])
-        
-        context = "\n\n".join([f"**{s['title']}**: {s['snippet']}" for s in sources if s['source'] != 'Error'])
-        
-        prompt = f"""You are a helpful AI assistant. Based on the following sources, provide a comprehensive and well-structured answer to this question: {query}
-
-Sources:
-{context}
-
-Instructions:
-- Provide a detailed, informative answer
-- Use bullet points and clear structure
-- Cite information naturally
-- If sources are insufficient, acknowledge limitations
-- Be accurate and objective
-
-Answer:"""
+        client = get_openai_client()
+        prompt = format_prompt(query, context)
         
-        response = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model=MODEL_CONFIGS['openai']['model'],
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            stream=True
         )
         
-        return response.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     
     except Exception as e:
         print(f"OpenAI error: {e}")
-        return f"Error generating answer with OpenAI: {str(e)}\n\nPlease check your API key or try a different model."
+        yield f"Error generating answer with OpenAI: {str(e)}\n\nPlease check your API key or try a different model."
 
-def generate_answer_local(query, sources):
-    """Generate AI answer using Ollama (local)"""
+def stream_answer_local(query, context):
+    """Stream AI answer from Ollama (local) chunk by chunk"""
     try:
-        context = "\n\n".join([f"**{s['title']}**: {s['snippet']}" for s in sources if s['source'] != 'Error'])
-        
-        prompt = f"""Based on the following sources, answer this question: {query}
-
-Sources:
-{context}
-
-Provide a comprehensive answer:"""
+        prompt = format_prompt(query, context, LOCAL_PROMPT_TEMPLATE)
         
-        # Get model from config
-        local_model = MODEL_CONFIGS['local']['model']
-        
-        response = requests.post(
+        response = SERPER_SESSION.post(
             'http://localhost:11434/api/generate',
             json={
-                'model': local_model,
+                'model': MODEL_CONFIGS['local']['model'],
                 'prompt': prompt,
-                'stream': False
+                'stream': True
             },
-            timeout=30
+            timeout=30,
+            stream=True
         )
         
-        if response.status_code == 200:
-            return response.json().get('response', 'No response generated')
-        else:
-            return f"Error: Ollama returned status code {response.status_code}"
+        if response.status_code != 200:
+            yield f"Error: Ollama returned status code {response.status_code}"
+            return
+        
+        # Ollama streams one JSON object per line
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get('response'):
+                yield data['response']
+            if data.get('done'):
+                break
     
     except requests.exceptions.ConnectionError:
-        return "Error: Cannot connect to Ollama. Make sure Ollama is running locally (http://localhost:11434)"
+        yield "Error: Cannot connect to Ollama. Make sure Ollama is running locally (http://localhost:11434)"
     except Exception as e:
         print(f"Local AI error: {e}")
-        return f"Error generating answer with Ollama: {str(e)}"
+        yield f"Error generating answer with Ollama: {str(e)}"
 
-def generate_answer(query, sources, mode='groq'):
-    """Generate answer using selected AI backend"""
+def stream_answer(query, context, mode='groq'):
+    """Stream answer for a prebuilt context using selected AI backend"""
     if mode == 'openai':
-        return generate_answer_openai(query, sources)
+        return stream_answer_openai(query, context)
     elif mode == 'local':
-        return generate_answer_local(query, sources)
+        return stream_answer_local(query, context)
     else:  # default to groq
-        return generate_answer_groq(query, sources)
+        return stream_answer_groq(query, context)
+
+def store_pending_answer(token, query, context, mode):
+    """Park a search's answer inputs until its stream is opened"""
+    if redis_client is not None:
+        redis_store_pending_answer(token, (query, context, mode))
+        return
+    
+    with pending_answers_lock:
+        pending_answers[token] = (query, context, mode)
+
+def has_pending_answer(token):
+    """Check if a search is still waiting for its answer stream"""
+    if redis_client is not None:
+        return redis_has_pending_answer(token)
+    
+    with pending_answers_lock:
+        return token in pending_answers
+
+def pop_pending_answer(token):
+    """Take a search's (query, context, mode), or None if unknown or already streamed"""
+    if redis_client is not None:
+        return redis_pop_pending_answer(token)
+    
+    with pending_answers_lock:
+        return pending_answers.pop(token, None)
 
 def add_to_history(query, mode):
     """Add search to history"""
-    global search_history
-    
     history_entry = {
         'query': query,
         'mode': mode,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'timestamp': datetime.now().replace(microsecond=0)
     }
     
-    # Add to beginning of list
-    search_history.insert(0, history_entry)
+    if redis_client is not None:
+        redis_add_to_history(history_entry)
+        return
     
-    # Keep only last MAX_HISTORY items
-    search_history = search_history[:MAX_HISTORY]
+    # Add to the front; the deque drops the oldest entry past MAX_HISTORY
+    search_history.appendleft(history_entry)
+
+def get_history(limit=MAX_HISTORY):
+    """Get the most recent searches, newest first"""
+    if redis_client is not None:
+        return redis_get_history(limit)
+    return list(islice(search_history, limit))
 
 def get_current_mode():
     """Get current AI mode from session"""
@@ -357,6 +819,10 @@ def get_model_info(mode=None):
         'status': 'active'
     }
 
+def ojsonify(obj, status=200):
+    """Build a JSON response using orjson (serializes datetimes natively)"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
 # ========== ROUTES ==========
 
 @app.route('/')
@@ -365,15 +831,15 @@ def index():
     model_info = get_model_info()
     
     search_info = {
-        'primary': 'Serper API',
-        'fallback': 'DuckDuckGo',
+        'primary': 'Serper API + DuckDuckGo (raced, first result wins)',
+        'fallback': 'None',
         'status': 'Ready'
     }
     
     return render_template('index.html', 
                          model_info=model_info, 
                          search_info=search_info,
-                         history=search_history[:5])  # Show last 5 searches
+                         history=get_history(5))  # Show last 5 searches
 
 @app.route('/search', methods=['POST'])
 @rate_limit_decorator
@@ -397,16 +863,26 @@ def search():
         # Search the web (cached)
         sources = search_web(query)
         
-        # Generate AI answer
-        answer = generate_answer(query, sources, mode)
+        # Built once and shared by the model choice and the answer stream
+        context = build_context(sources)
+        
+        # Show the Groq tier that will actually write this answer
+        if mode == 'groq':
+            model_info['model'] = select_groq_model(query, context).replace('-versatile', '')
+        
+        # The answer itself is streamed separately from /answer_stream
+        answer_token = secrets.token_urlsafe(16)
+        store_pending_answer(answer_token, query, context, mode)
         
         # Add to history
         add_to_history(query, mode)
         
         return render_template('results.html', 
                              query=query,
-                             answer=answer,
+                             answer_token=answer_token,
                              sources=sources,
+                             sources_key=hashlib.blake2b(orjson.dumps(sources), digest_size=16).hexdigest(),
+                             cache_timeout=CACHE_DURATION,
                              model_info=model_info,
                              rate_limit_remaining=remaining)
     
@@ -415,23 +891,61 @@ def search():
         return render_template('error.html', 
                              error=f'An error occurred: {str(e)}'), 500
 
+@app.route('/answer_stream/<token>')
+def answer_stream(token):
+    """Stream the AI answer for a search as server-sent events"""
+    # Unknown or already consumed token; 204 tells EventSource not to reconnect
+    if not has_pending_answer(token):
+        return '', 204
+    
+    # Cap how many answers one user can have streaming at once. The token stays
+    # pending, and the retry field makes EventSource reconnect for it shortly.
+    user_id = get_user_id()
+    slot_id = acquire_answer_slot(user_id)
+    if slot_id is None:
+        busy = orjson.dumps('Too many answers in progress. Waiting for one to finish...')
+        return Response(b"retry: 2000\nevent: busy\ndata: " + busy + b"\n\n",
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    
+    pending = pop_pending_answer(token)
+    
+    # Another request consumed the token while we were getting a slot
+    if pending is None:
+        release_answer_slot(user_id, slot_id)
+        return '', 204
+    
+    query, context, mode = pending
+    
+    def generate():
+        for text in stream_answer(query, context, mode):
+            yield b"data: " + orjson.dumps(text) + b"\n\n"
+        yield b"event: done\ndata: {}\n\n"
+    
+    response = Response(stream_with_context(generate()),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs even if the client disconnects before the stream starts
+    response.call_on_close(lambda: release_answer_slot(user_id, slot_id))
+    return response
+
 @app.route('/switch_mode', methods=['POST'])
 def switch_mode():
     """Switch AI backend mode"""
     mode = request.form.get('mode', 'groq')
     
     if mode not in MODEL_CONFIGS:
-        return jsonify({
+        return ojsonify({
             'success': False,
             'error': f'Invalid mode: {mode}'
-        }), 400
+        }, status=400)
     
     # Save mode to session
     session['ai_mode'] = mode
     
     config = MODEL_CONFIGS[mode]
     
-    return jsonify({
+    return ojsonify({
         'success': True,
         'mode': mode,
         'backend': config['backend'],
@@ -441,17 +955,26 @@ def switch_mode():
 @app.route('/history')
 def history():
     """Get search history"""
-    return jsonify({
-        'history': search_history,
-        'count': len(search_history)
+    entries = get_history()
+    return ojsonify({
+        'history': entries,
+        'count': len(entries)
     })
 
 @app.route('/clear_cache', methods=['POST'])
 def clear_cache():
     """Clear search cache"""
-    global search_cache
-    search_cache.clear()
-    return jsonify({
+    if redis_client is not None:
+        redis_clear_cache()
+    
+    with cache_lock:
+        search_cache.clear()
+        failure_streaks.clear()
+    try:
+        fragment_cache.clear()
+    except Exception as e:
+        print(f"Fragment cache error: {e}")
+    return ojsonify({
         'success': True,
         'message': 'Cache cleared successfully'
     })
@@ -459,9 +982,11 @@ def clear_cache():
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     """Clear search history"""
-    global search_history
+    if redis_client is not None:
+        redis_clear_history()
+    
     search_history.clear()
-    return jsonify({
+    return ojsonify({
         'success': True,
         'message': 'History cleared successfully'
     })
@@ -472,36 +997,47 @@ def stats():
     user_id = get_user_id()
     _, remaining = check_rate_limit(user_id)
     
-    return jsonify({
-        'cache_size': len(search_cache),
-        'history_size': len(search_history),
+    return ojsonify({
+        # Counting Redis entries would need a keyspace scan, so it's reported as unknown
+        'cache_size': None if redis_client is not None else len(search_cache),
+        'history_size': len(get_history()),
         'current_mode': get_current_mode(),
         'available_modes': list(MODEL_CONFIGS.keys()),
         'rate_limit_remaining': remaining,
         'rate_limit_max': RATE_LIMIT_SEARCHES
     })
 
+# The manifest never changes at runtime, so serialize it once
+MANIFEST_JSON = orjson.dumps({
+    "name": "HybridSearch AI",
+    "short_name": "HybridSearch",
+    "description": "AI-powered search engine with multiple backends",
+    "start_url": "/",
+    "display": "standalone",
+    "background_color": "#667eea",
+    "theme_color": "#667eea",
+    "orientation": "portrait-primary",
+    "icons": [
+        {
+            "src": "data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 100 100'><text y='.9em' font-size='90'>🔍</text></svg>",
+            "sizes": "192x192",
+            "type": "image/svg+xml"
+        }
+    ]
+})
+MANIFEST_ETAG = hashlib.md5(MANIFEST_JSON).hexdigest()
+
 @app.route('/manifest.json')
 def manifest():
     """Serve PWA manifest"""
-    manifest_data = {
-        "name": "HybridSearch AI",
-        "short_name": "HybridSearch",
-        "description": "AI-powered search engine with multiple backends",
-        "start_url": "/",
-        "display": "standalone",
-        "background_color": "#667eea",
-        "theme_color": "#667eea",
-        "orientation": "portrait-primary",
-        "icons": [
-            {
-                "src": "data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 100 100'><text y='.9em' font-size='90'>🔍</text></svg>",
-                "sizes": "192x192",
-                "type": "image/svg+xml"
-            }
-        ]
-    }
-    return jsonify(manifest_data)
+    if request.if_none_match.contains(MANIFEST_ETAG):
+        response = Response(status=304)
+    else:
+        response = Response(MANIFEST_JSON, mimetype='application/json')
+    
+    response.set_etag(MANIFEST_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
@@ -543,6 +1079,7 @@ if __name__ == '__main__':
     
     # Check if running in production
     if os.getenv('FLASK_ENV') == 'production':
+        print("Tip: for production traffic run: gunicorn -k gevent -w 4 --worker-connections 500 wsgi:app\n")
         app.run(debug=False, host='0.0.0.0', port=5000)
     else:
         app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
 from openai import OpenAI
 from groq import Groq
-import subprocess
+import requests
 import json
 
+# Shared HTTP session so the Ollama connection is kept alive between calls
+SESSION = requests.Session()
+
 class LLMHandler:
     def __init__(self):
         self.mode = os.getenv('LLM_MODE', 'local')
@@ -26,7 +29,7 @@ class LLMHandler:
         
         try:
             if self.mode == 'local':
-                return self._generate_local(full_prompt)
+                return self._generate_local(full_prompt, max_tokens)
             elif self.mode == 'groq':
                 return self._generate_groq(full_prompt, max_tokens)
             elif self.mode == 'openai':
@@ -34,24 +37,28 @@ class LLMHandler:
         except Exception as e:
             return f"Error generating response: {str(e)}"
     
-    def _generate_local(self, prompt):
-        """Use Ollama for local generation"""
+    def _generate_local(self, prompt, max_tokens):
+        """Use Ollama HTTP API for local generation"""
         try:
-            result = subprocess.run(
-                ['ollama', 'run', self.model, prompt],
-                capture_output=True,
-                text=True,
+            response = SESSION.post(
+                'http://localhost:11434/api/generate',
+                json={
+                    'model': self.model,
+                    'prompt': prompt,
+                    'stream': False,
+                    'options': {'num_predict': max_tokens}
+                },
                 timeout=60
             )
             
-            if result.returncode == 0:
-                return result.stdout.strip()
+            if response.status_code == 200:
+                return response.json().get('response', '').strip()
             else:
-                return f"Error: {result.stderr}"
-        except subprocess.TimeoutExpired:
+                return f"Error: {response.text}"
+        except requests.exceptions.Timeout:
             return "Error: Request timed out. Try a shorter prompt or faster model."
-        except FileNotFoundError:
-            return "Error: Ollama not installed. Please install from https://ollama.com"
+        except requests.exceptions.ConnectionError:
+            return "Error: Cannot connect to Ollama. Make sure it is installed (https://ollama.com) and running."
         except Exception as e:
             return f"Error with local model: {str(e)}"
     
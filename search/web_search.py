@@ -1,44 +1,84 @@
 from duckduckgo_search import DDGS
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 import os
 
+# Shared worker pool for fanning out searches across backends
+_executor = ThreadPoolExecutor(max_workers=4)
+
 class WebSearch:
     def __init__(self):
         self.serper_key = os.getenv('SERPER_API_KEY')
+        self.serper_headers = {
+            'X-API-KEY': self.serper_key or '',
+            'Content-Type': 'application/json'
+        }
+        
+        # Keep one DuckDuckGo client so its HTTP connection is reused
+        self.ddgs = DDGS(timeout=8)
+        
+        # Reuse the Serper HTTPS connection across searches
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(
+                total=3,
+                read=False,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(['POST'])
+            )
+        ))
     
     def search(self, query, max_results=5):
         """
-        Search using Serper API with DuckDuckGo fallback
+        Search Serper API and DuckDuckGo concurrently, returning the first non-empty result
         """
-        # Try Serper first if API key is available
-        if self.serper_key:
-            try:
-                results = self._search_serper(query, max_results)
+        # Without a Serper key there is nothing to race against
+        if not self.serper_key:
+            print(f"🦆 DuckDuckGo used for: {query}")
+            return self._search_duckduckgo(query, max_results)
+        
+        futures = {
+            _executor.submit(self._search_serper, query, max_results): 'Serper API',
+            _executor.submit(self._search_duckduckgo, query, max_results): 'DuckDuckGo'
+        }
+        
+        try:
+            for future in as_completed(futures, timeout=10):
+                backend = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"⚠️ {backend} failed: {e}")
+                    continue
+                
                 if results:
-                    print(f"✅ Serper API used for: {query}")
+                    print(f"✅ {backend} used for: {query}")
                     return results
-            except Exception as e:
-                print(f"⚠️ Serper failed, using DuckDuckGo fallback: {e}")
+        except TimeoutError:
+            print(f"⚠️ Search timed out for: {query}")
+        finally:
+            # Only cancels a backend that has not started yet; a running call finishes in the background
+            for future in futures:
+                future.cancel()
         
-        # Fallback to DuckDuckGo
-        print(f"🦆 DuckDuckGo used for: {query}")
-        return self._search_duckduckgo(query, max_results)
+        return []
     
     def _search_serper(self, query, max_results):
         """
         Search using Serper API (Google results)
         """
         url = "https://google.serper.dev/search"
-        headers = {
-            'X-API-KEY': self.serper_key,
-            'Content-Type': 'application/json'
-        }
         payload = {
             'q': query,
             'num': max_results
         }
         
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = self.session.post(url, headers=self.serper_headers, json=payload, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -71,7 +111,7 @@ class WebSearch:
         Free search using DuckDuckGo (no API key needed)
         """
         try:
-            ddgs_results = DDGS().text(query, max_results=max_results)
+            ddgs_results = self.ddgs.text(query, max_results=max_results)
             
             return [
                 {
@@ -88,17 +128,17 @@ class WebSearch:
     
     def get_search_stats(self):
         """
-        Return which search backend is active
+        Return which search backends are raced
         """
         if self.serper_key:
             return {
-                'primary': 'Serper API (Google)',
-                'fallback': 'DuckDuckGo',
+                'backends': ['Serper API (Google)', 'DuckDuckGo'],
+                'strategy': 'Concurrent - first non-empty result wins',
                 'status': 'Active'
             }
         else:
             return {
-                'primary': 'DuckDuckGo',
-                'fallback': 'None',
+                'backends': ['DuckDuckGo'],
+                'strategy': 'Single backend',
                 'status': 'Active (Free)'
             }
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+WSGI entry point for production
+
+Run with gevent workers so each worker can wait on many Serper/LLM calls at once:
+    gunicorn -k gevent -w 4 -b 0.0.0.0:5000 --worker-connections 500 wsgi:app
+"""
+# Patch blocking I/O (sockets, threads, locks) before anything else is imported
+from gevent import monkey
+monkey.patch_all()
+
+from app import app
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)